@@ -1,12 +1,12 @@
 import os
 import logging
-from flask import Flask, session, request
+import threading
+from flask import Flask, session, request, abort
 from flask_session import Session
 from flask_limiter.util import get_remote_address
-from apscheduler.schedulers.background import BackgroundScheduler
 
 from config import config
-from extensions import limiter
+from extensions import limiter, OrjsonProvider
 from services.session_manager import SessionManager
 from services.quota_manager import QuotaManager
 from services.image_processor import ImageProcessor
@@ -23,6 +23,7 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(config)
+app.json = OrjsonProvider(app)
 
 # Initialize Flask-Session
 Session(app)
@@ -44,19 +45,49 @@ app.image_processor = image_processor
 app.gif_builder = gif_builder
 app.video_processor = video_processor
 
-# Set up cleanup scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    func=session_manager.cleanup_old_sessions,
-    trigger='interval',
-    hours=config.CLEANUP_CONFIG['cleanup_interval'],
-    id='cleanup_old_sessions'
-)
-scheduler.start()
+
+def evict_removed_sessions(removed):
+    """Drop cached image info for sessions removed by cleanup"""
+    for session_id in removed:
+        image_processor.evict_session_cache(session_id)
+
+
+def run_periodically(func, interval):
+    """Run func every interval seconds on a daemon timer thread"""
+    def run():
+        try:
+            func()
+        except Exception as e:
+            logger.error(f"Periodic task {func.__name__} failed: {e}")
+        finally:
+            schedule(interval)
+
+    def schedule(delay):
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+
+    schedule(interval)
+
+
+# Set up background jobs (first cleanup 60s after boot)
+session_manager.start_cleanup_worker(config.CLEANUP_CONFIG['cleanup_interval'] * 3600,
+                                     on_removed=evict_removed_sessions)
+session_manager.schedule_cleanup()
+run_periodically(session_manager.flush_access_times, config.CLEANUP_CONFIG['access_flush_interval'])
 
 logger.info("Cleanup scheduler started")
 
 
+@app.before_request
+def reject_oversized_request():
+    """Reject bodies over the endpoint's size limit before they are read"""
+    limit = config.UPLOAD_CONTENT_LENGTH.get(request.endpoint, config.MAX_CONTENT_LENGTH)
+    if request.content_length is not None and request.content_length > limit:
+        abort(413)
+    request.max_content_length = limit
+
+
 @app.before_request
 def ensure_session():
     """Ensure each request has a valid session"""
@@ -65,7 +96,8 @@ def ensure_session():
         session_manager.initialize_session_storage(session['id'])
         logger.info(f"New session created: {session['id']}")
     else:
-        # Update last accessed time
+        # Update last accessed time (buffered in memory, flushed periodically);
+        # GETs count too, so browse/download-only users keep their files
         session_manager.update_session_access(session['id'])
 
 
@@ -97,24 +129,32 @@ def internal_error(e):
     }, 500
 
 
+# Security headers added to every response
+_SECURITY_HEADERS = (
+    ('X-Content-Type-Options', 'nosniff'),
+    ('X-Frame-Options', 'SAMEORIGIN'),
+    ('X-XSS-Protection', '1; mode=block'),
+    ('Referrer-Policy', 'strict-origin-when-cross-origin'),
+)
+
+# Content Security Policy for HTML pages - allow inline styles for Bootstrap
+_CSP = (
+    "default-src 'self'; "
+    "script-src 'self' https://cdn.jsdelivr.net; "
+    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
+    "font-src 'self' https://cdn.jsdelivr.net; "
+    "img-src 'self' data: blob:; "
+    "connect-src 'self'"
+)
+
+
 @app.after_request
 def add_security_headers(response):
     """Add security headers to all responses"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-
-    # Content Security Policy - allow inline styles for Bootstrap
-    if 'text/html' in response.content_type:
-        response.headers['Content-Security-Policy'] = (
-            "default-src 'self'; "
-            "script-src 'self' https://cdn.jsdelivr.net; "
-            "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
-            "font-src 'self' https://cdn.jsdelivr.net; "
-            "img-src 'self' data: blob:; "
-            "connect-src 'self'"
-        )
+    response.headers.update(_SECURITY_HEADERS)
+
+    if response.mimetype == 'text/html':
+        response.headers['Content-Security-Policy'] = _CSP
 
     return response
 
@@ -138,7 +178,6 @@ def index():
 if __name__ == '__main__':
     # Ensure required directories exist
     os.makedirs(config.USER_DATA_DIR, exist_ok=True)
-    os.makedirs(config.SESSION_FILE_DIR, exist_ok=True)
 
     # Run the app
     logger.info("Starting AniGiffy server...")
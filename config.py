@@ -1,21 +1,36 @@
 import os
 import secrets
+from datetime import timedelta
+
+import redis
 
 class Config:
     # Flask settings
     SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
-    MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max request size
+    MAX_CONTENT_LENGTH = 1024 * 1024  # 1MB default request size (JSON APIs); uploads raise it per endpoint
+
+    # Redis (sessions)
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 
     # Session settings
-    SESSION_TYPE = 'filesystem'
-    SESSION_FILE_DIR = os.path.join(os.getcwd(), 'flask_session')
+    SESSION_TYPE = 'redis'
+    SESSION_REDIS = redis.Redis(
+        connection_pool=redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=64)
+    )
+    SESSION_KEY_PREFIX = 'anigiffy:'
     SESSION_PERMANENT = False
+    PERMANENT_SESSION_LIFETIME = timedelta(hours=168)  # Redis TTL; matches CLEANUP_CONFIG['session_lifetime']
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
 
     # User data directory (outside static to prevent direct URL access)
     USER_DATA_DIR = os.path.join(os.getcwd(), 'user_data')
 
+    # Serve user files through nginx X-Accel-Redirect instead of send_file.
+    # Requires an internal nginx location mapping X_ACCEL_REDIRECT_PREFIX to USER_DATA_DIR.
+    USE_X_ACCEL_REDIRECT = os.environ.get('USE_X_ACCEL_REDIRECT', '').lower() in ('1', 'true', 'yes')
+    X_ACCEL_REDIRECT_PREFIX = '/_protected/'
+
     # Resource quotas per session
     QUOTAS = {
         'max_upload_size': 25 * 1024 * 1024,  # 25MB per image (modern phone photos)
@@ -29,6 +44,15 @@ class Config:
         'max_video_duration': 120,  # seconds
     }
 
+    # Request size limits for upload endpoints (quota plus room for multipart framing)
+    UPLOAD_CONTENT_LENGTH = {
+        'frames.upload_image': QUOTAS['max_upload_size'] + 64 * 1024,
+        'video.upload_video': QUOTAS['max_video_size'] + 64 * 1024,
+    }
+
+    # Rate limiter storage (shared across workers)
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', REDIS_URL)
+
     # Rate limiting (requests per time period)
     RATE_LIMITS = {
         'upload': '10 per minute, 50 per hour',
@@ -43,20 +67,22 @@ class Config:
         'session_lifetime': 168,  # hours (1 week) - sessions older than this are deleted
         'cleanup_interval': 24,  # hours - how often to run cleanup
         'orphan_file_age': 24,  # hours - remove orphaned files after this time
+        'access_flush_interval': 30,  # seconds - how often buffered access times are written
     }
 
     # Allowed file types
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-    ALLOWED_MIMETYPES = {
+    ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'webp'})
+    ALLOWED_EXTENSIONS_MSG = 'png, jpg, jpeg, gif, webp'
+    ALLOWED_MIMETYPES = frozenset({
         'image/png',
         'image/jpeg',
         'image/gif',
         'image/webp'
-    }
+    })
 
     # Video file types
-    ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov'}
-    ALLOWED_VIDEO_MIMETYPES = {'video/mp4', 'video/quicktime'}
+    ALLOWED_VIDEO_EXTENSIONS = frozenset({'mp4', 'mov'})
+    ALLOWED_VIDEO_MIMETYPES = frozenset({'video/mp4', 'video/quicktime'})
 
 class DevelopmentConfig(Config):
     DEBUG = True
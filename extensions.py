@@ -1,11 +1,29 @@
 """Flask extensions - initialized separately to avoid circular imports"""
 
+import orjson
+from flask.json.provider import JSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
+from config import config
+
 # Create limiter without app - will be initialized in app.py
+# Counters live in Redis so limits are shared across gunicorn workers.
+# The moving-window strategy runs as a registered Lua script (EVALSHA),
+# so each check is a single atomic round-trip.
 limiter = Limiter(
     key_func=get_remote_address,
-    storage_uri="memory://",
+    storage_uri=config.RATELIMIT_STORAGE_URI,
+    strategy="moving-window",
     default_limits=["1000 per hour"]
 )
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, used by jsonify() and request.get_json()"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
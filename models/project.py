@@ -1,14 +1,47 @@
-import json
-import uuid
-from datetime import datetime
+import time
+import logging
+import secrets
+import orjson
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _format_ns(ns):
+    """Format epoch nanoseconds as a naive UTC ISO timestamp"""
+    return (_EPOCH + timedelta(microseconds=ns // 1000)).isoformat()
+
+
+def _parse_iso(value):
+    """
+    Parse an ISO timestamp into epoch nanoseconds
+
+    Naive values are UTC, as projects have always been saved with UTC times
+    (formerly datetime.utcnow()). Unparseable values fall back to the
+    current time with a warning.
+    """
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid project timestamp {value!r}, using current time")
+        return time.time_ns()
+
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
 
 class Frame:
     """Represents a single frame in an animation"""
 
+    __slots__ = ('id', 'file', 'duration')
+
     def __init__(self, file_path, duration=100, frame_id=None):
-        self.id = frame_id or f"frame-{uuid.uuid4().hex[:8]}"
+        self.id = frame_id or f"frame-{secrets.token_hex(4)}"
         self.file = file_path
         self.duration = duration
 
@@ -35,8 +68,8 @@ class Project:
                  transparent=False, background_color='#FFFFFF', alpha_threshold=128,
                  transition_type='crossfade', transition_time=0, transition_steps=5):
         self.name = name
-        self.created = datetime.utcnow().isoformat()
-        self.modified = datetime.utcnow().isoformat()
+        # Timestamps are kept as epoch nanoseconds and formatted on demand
+        self._created_ns = self._modified_ns = time.time_ns()
         self.settings = {
             'width': width,
             'height': height,
@@ -49,7 +82,39 @@ class Project:
             'transitionTime': transition_time,
             'transitionSteps': transition_steps
         }
-        self.frames = []
+        self._frames = []
+        self._frame_index = {}  # frame ID -> position in self._frames
+
+    @property
+    def created(self):
+        return _format_ns(self._created_ns)
+
+    @created.setter
+    def created(self, value):
+        self._created_ns = _parse_iso(value)
+
+    @property
+    def modified(self):
+        return _format_ns(self._modified_ns)
+
+    @modified.setter
+    def modified(self, value):
+        self._modified_ns = _parse_iso(value)
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @frames.setter
+    def frames(self, frames):
+        self._frames = list(frames)
+        self._frame_index = {}
+        self._rebuild_index_from(0)
+
+    def _rebuild_index_from(self, start):
+        """Re-index frame positions from start to the end of the list"""
+        for i in range(start, len(self._frames)):
+            self._frame_index[self._frames[i].id] = i
 
     def add_frame(self, file_path, duration=None):
         """Add a frame to the project"""
@@ -57,40 +122,38 @@ class Project:
             duration = self.settings['defaultDuration']
 
         frame = Frame(file_path, duration)
-        self.frames.append(frame)
+        self._frame_index[frame.id] = len(self._frames)
+        self._frames.append(frame)
         self.update_modified()
         return frame
 
     def remove_frame(self, frame_id):
         """Remove a frame by ID"""
-        self.frames = [f for f in self.frames if f.id != frame_id]
+        idx = self._frame_index.pop(frame_id, None)
+        if idx is not None:
+            del self._frames[idx]
+            self._rebuild_index_from(idx)
         self.update_modified()
 
     def reorder_frames(self, frame_ids):
         """Reorder frames based on a list of frame IDs"""
-        # Create a mapping of frame ID to frame object
-        frame_map = {f.id: f for f in self.frames}
-
-        # Reorder based on provided IDs
-        new_order = []
-        for frame_id in frame_ids:
-            if frame_id in frame_map:
-                new_order.append(frame_map[frame_id])
-
-        self.frames = new_order
+        self.frames = [self._frames[self._frame_index[frame_id]]
+                       for frame_id in frame_ids if frame_id in self._frame_index]
         self.update_modified()
 
     def update_frame(self, frame_id, **kwargs):
         """Update frame properties"""
-        for frame in self.frames:
-            if frame.id == frame_id:
-                if 'duration' in kwargs:
-                    frame.duration = kwargs['duration']
-                if 'file' in kwargs:
-                    frame.file = kwargs['file']
-                self.update_modified()
-                return frame
-        return None
+        idx = self._frame_index.get(frame_id)
+        if idx is None:
+            return None
+
+        frame = self._frames[idx]
+        if 'duration' in kwargs:
+            frame.duration = kwargs['duration']
+        if 'file' in kwargs:
+            frame.file = kwargs['file']
+        self.update_modified()
+        return frame
 
     def update_settings(self, **kwargs):
         """Update project settings"""
@@ -119,7 +182,7 @@ class Project:
 
     def update_modified(self):
         """Update the modified timestamp"""
-        self.modified = datetime.utcnow().isoformat()
+        self._modified_ns = time.time_ns()
 
     def to_dict(self):
         """Convert project to dictionary"""
@@ -133,7 +196,7 @@ class Project:
 
     def to_json(self):
         """Convert project to JSON string"""
-        return json.dumps(self.to_dict(), indent=2)
+        return orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2).decode()
 
     def save(self, file_path):
         """Save project to a JSON file"""
@@ -158,20 +221,20 @@ class Project:
             transition_steps=settings.get('transitionSteps', 5)
         )
 
-        project.created = data.get('created', datetime.utcnow().isoformat())
-        project.modified = data.get('modified', datetime.utcnow().isoformat())
+        if 'created' in data:
+            project.created = data['created']
+        if 'modified' in data:
+            project.modified = data['modified']
 
         # Load frames
-        for frame_data in data.get('frames', []):
-            frame = Frame.from_dict(frame_data)
-            project.frames.append(frame)
+        project.frames = [Frame.from_dict(frame_data) for frame_data in data.get('frames', [])]
 
         return project
 
     @classmethod
     def from_json(cls, json_str):
         """Create a project from a JSON string"""
-        data = json.loads(json_str)
+        data = orjson.loads(json_str)
         return cls.from_dict(data)
 
     @classmethod
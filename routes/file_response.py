@@ -0,0 +1,69 @@
+import os
+import re
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request, send_file
+
+# Names the app writes into session directories (UUID uploads, vframe_*,
+# secure_filename'd project names) - no path separators or leading dot
+_SAFE_FILENAME_RE = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]*\.(?:gif|png|jpe?g|webp)')
+
+
+def is_safe_filename(filename):
+    """Check a requested filename against the names the app generates"""
+    return _SAFE_FILENAME_RE.fullmatch(filename) is not None
+
+
+def send_session_file(file_path, mimetype, as_attachment=False, download_name=None):
+    """
+    Send a file from a session directory
+
+    Responses carry an ETag/Last-Modified pair and answer conditional
+    requests with 304 Not Modified without touching the file contents.
+
+    When USE_X_ACCEL_REDIRECT is enabled, only headers are returned and the
+    reverse proxy (nginx) streams the file from its internal location.
+    Otherwise the file is sent through Flask with send_file.
+    """
+    st = file_path.stat()
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (request.if_modified_since is not None
+                        and request.if_modified_since >= last_modified)
+
+    if not_modified:
+        response = Response(status=304)
+    elif not current_app.config.get('USE_X_ACCEL_REDIRECT'):
+        response = send_file(
+            file_path,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=False,
+            etag=False
+        )
+    else:
+        # Path relative to USER_DATA_DIR, which nginx maps to the internal prefix
+        relative = os.path.relpath(file_path, current_app.session_manager.user_data_realpath)
+
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = (
+            current_app.config['X_ACCEL_REDIRECT_PREFIX'] + relative.replace(os.sep, '/')
+        )
+        if as_attachment or download_name:
+            disposition = 'attachment' if as_attachment else 'inline'
+            response.headers.set('Content-Disposition', disposition,
+                                 filename=download_name or file_path.name)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Session files are private; extracted video frames reuse names,
+    # so clients must revalidate (cheap 304) rather than cache blindly
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
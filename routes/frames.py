@@ -1,11 +1,11 @@
-import uuid
+import os
+import secrets
 import logging
 from pathlib import Path
 from flask import Blueprint, request, jsonify, session, current_app
-from werkzeug.utils import secure_filename
-from PIL import Image
 
 from extensions import limiter
+from routes.file_response import send_session_file, is_safe_filename
 
 logger = logging.getLogger(__name__)
 
@@ -26,18 +26,18 @@ def upload_image():
             return jsonify({'error': 'No file selected'}), 400
 
         # Validate file extension
-        if not current_app.image_processor.validate_file_extension(file.filename):
+        ext = current_app.image_processor.get_file_extension(file.filename)
+        if ext is None:
             return jsonify({
                 'error': 'Invalid file type',
-                'message': f'Allowed types: {", ".join(current_app.config["ALLOWED_EXTENSIONS"])}'
+                'message': f'Allowed types: {current_app.config["ALLOWED_EXTENSIONS_MSG"]}'
             }), 400
 
-        # Check file size
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
-
-        can_upload, message = current_app.quota_manager.can_upload(session['id'], file_size)
+        # Reject sessions already at their image or storage quota before
+        # writing anything; requests far over the size limit were already
+        # rejected from Content-Length by reject_oversized_request
+        stats = current_app.session_manager.get_session_stats(session['id'])
+        can_upload, message = current_app.quota_manager.can_upload(session['id'], 0, stats=stats)
         if not can_upload:
             return jsonify({
                 'error': 'Upload not allowed',
@@ -45,15 +45,25 @@ def upload_image():
             }), 429
 
         # Generate unique filename
-        ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
+        filename = f"{secrets.token_hex(16)}.{ext}"
 
         # Save to uploads directory
         uploads_dir = current_app.session_manager.safe_path(session['id'], 'uploads')
         uploads_dir.mkdir(parents=True, exist_ok=True)
 
         file_path = uploads_dir / filename
-        file.save(file_path)
+        file.save(file_path, buffer_size=1024 * 1024)
+
+        # Check the stored size (Content-Length also counts the multipart
+        # framing) against the per-file and storage quotas
+        file_size = file_path.stat().st_size
+        can_upload, message = current_app.quota_manager.can_upload(session['id'], file_size, stats=stats)
+        if not can_upload:
+            file_path.unlink()
+            return jsonify({
+                'error': 'Upload not allowed',
+                'message': message
+            }), 429
 
         # Validate the image
         img, error = current_app.image_processor.load_and_validate_image(file_path)
@@ -110,7 +120,7 @@ def add_frame():
             }), 404
 
         # Create frame object
-        frame_id = f"frame-{uuid.uuid4().hex[:8]}"
+        frame_id = f"frame-{secrets.token_hex(4)}"
 
         return jsonify({
             'success': True,
@@ -213,23 +223,24 @@ def list_images():
             return jsonify({'images': []}), 200
 
         images = []
-        for file_path in uploads_dir.glob('*'):
-            if file_path.is_file():
+        with os.scandir(uploads_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
                 try:
-                    # Get image info
-                    img = Image.open(file_path)
-                    width, height = img.size
-                    file_size = file_path.stat().st_size
+                    # Get image info (cached until the file changes)
+                    file_size, width, height = current_app.image_processor.get_image_info(
+                        session['id'], entry)
 
                     images.append({
-                        'filename': file_path.name,
-                        'path': f"uploads/{file_path.name}",
+                        'filename': entry.name,
+                        'path': f"uploads/{entry.name}",
                         'size': file_size,
                         'width': width,
                         'height': height
                     })
                 except Exception as e:
-                    logger.error(f"Failed to read image {file_path.name}: {e}")
+                    logger.error(f"Failed to read image {entry.name}: {e}")
 
         # Sort by modification time (newest first)
         images.sort(key=lambda i: i['filename'], reverse=True)
@@ -248,9 +259,12 @@ def list_images():
 def get_image(filename):
     """Serve an uploaded image file"""
     try:
-        from flask import send_file
-        # Secure filename
-        filename = secure_filename(filename)
+        # Validate filename
+        if not is_safe_filename(filename):
+            return jsonify({
+                'error': 'Invalid filename',
+                'message': f'Invalid image file name: {filename}'
+            }), 400
 
         # Get file path
         file_path = current_app.session_manager.safe_path(session['id'], 'uploads', filename)
@@ -261,7 +275,7 @@ def get_image(filename):
                 'message': f'Image file does not exist: {filename}'
             }), 404
 
-        return send_file(
+        return send_session_file(
             file_path,
             mimetype='image/png',
             as_attachment=False
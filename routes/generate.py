@@ -1,12 +1,12 @@
-import uuid
+import os
+import secrets
 import logging
 from pathlib import Path
-from flask import Blueprint, request, jsonify, session, current_app, send_file
+from flask import Blueprint, request, jsonify, session, current_app
 from werkzeug.utils import secure_filename
 
-from models.project import Project
-from config import config
 from extensions import limiter
+from routes.file_response import send_session_file, is_safe_filename
 
 logger = logging.getLogger(__name__)
 
@@ -24,8 +24,8 @@ def generate_preview():
         if not project_data:
             return jsonify({'error': 'No project data provided'}), 400
 
-        # Create project from data
-        project = Project.from_dict(project_data)
+        # Create and validate project from data
+        project, is_valid, errors = current_app.gif_builder.load_project(session['id'], project_data)
 
         if len(project.frames) == 0:
             return jsonify({
@@ -33,8 +33,6 @@ def generate_preview():
                 'message': 'Project must have at least one frame'
             }), 400
 
-        # Validate project
-        is_valid, errors = project.validate(config)
         if not is_valid:
             return jsonify({
                 'error': 'Validation failed',
@@ -48,7 +46,7 @@ def generate_preview():
         ext = '.png' if output_format == 'apng' else '.gif'
 
         # Generate output filename
-        output_filename = f"preview_{uuid.uuid4().hex[:8]}{ext}"
+        output_filename = f"preview_{secrets.token_hex(4)}{ext}"
 
         # Create output directory
         output_dir = current_app.session_manager.safe_path(session['id'], 'output')
@@ -66,7 +64,8 @@ def generate_preview():
             current_app.session_manager,
             session['id'],
             max_frames=max_frames,
-            output_format=output_format
+            output_format=output_format,
+            validated=True
         )
 
         if not success:
@@ -107,8 +106,8 @@ def generate_full():
         if not project_data:
             return jsonify({'error': 'No project data provided'}), 400
 
-        # Create project from data
-        project = Project.from_dict(project_data)
+        # Create and validate project from data
+        project, is_valid, errors = current_app.gif_builder.load_project(session['id'], project_data)
 
         if len(project.frames) == 0:
             return jsonify({
@@ -116,8 +115,6 @@ def generate_full():
                 'message': 'Project must have at least one frame'
             }), 400
 
-        # Validate project
-        is_valid, errors = project.validate(config)
         if not is_valid:
             return jsonify({
                 'error': 'Validation failed',
@@ -132,7 +129,7 @@ def generate_full():
 
         # Generate output filename
         safe_name = secure_filename(project.name) or 'animation'
-        output_filename = f"{safe_name}_{uuid.uuid4().hex[:8]}{ext}"
+        output_filename = f"{safe_name}_{secrets.token_hex(4)}{ext}"
 
         # Create output directory
         output_dir = current_app.session_manager.safe_path(session['id'], 'output')
@@ -146,7 +143,8 @@ def generate_full():
             output_path,
             current_app.session_manager,
             session['id'],
-            output_format=output_format
+            output_format=output_format,
+            validated=True
         )
 
         if not success:
@@ -177,8 +175,12 @@ def generate_full():
 def get_file(filename):
     """Serve a generated animation file (GIF or APNG)"""
     try:
-        # Secure filename
-        filename = secure_filename(filename)
+        # Validate filename
+        if not is_safe_filename(filename):
+            return jsonify({
+                'error': 'Invalid filename',
+                'message': f'Invalid file name: {filename}'
+            }), 400
 
         # Get file path
         file_path = current_app.session_manager.safe_path(session['id'], 'output', filename)
@@ -191,7 +193,7 @@ def get_file(filename):
 
         mimetype = 'image/png' if filename.endswith('.png') else 'image/gif'
 
-        return send_file(
+        return send_session_file(
             file_path,
             mimetype=mimetype,
             as_attachment=False,
@@ -210,8 +212,12 @@ def get_file(filename):
 def download_file(filename):
     """Download a generated animation file (GIF or APNG)"""
     try:
-        # Secure filename
-        filename = secure_filename(filename)
+        # Validate filename
+        if not is_safe_filename(filename):
+            return jsonify({
+                'error': 'Invalid filename',
+                'message': f'Invalid file name: {filename}'
+            }), 400
 
         # Get file path
         file_path = current_app.session_manager.safe_path(session['id'], 'output', filename)
@@ -224,7 +230,7 @@ def download_file(filename):
 
         mimetype = 'image/png' if filename.endswith('.png') else 'image/gif'
 
-        return send_file(
+        return send_session_file(
             file_path,
             mimetype=mimetype,
             as_attachment=True,
@@ -249,17 +255,17 @@ def list_outputs():
             return jsonify({'gifs': []}), 200
 
         gifs = []
-        for file_path in sorted(output_dir.iterdir()):
-            if file_path.is_file() and file_path.suffix in ('.gif', '.png'):
-                file_size = file_path.stat().st_size
-                modified = file_path.stat().st_mtime
-
-                gifs.append({
-                    'filename': file_path.name,
-                    'path': f"/api/generate/file/{file_path.name}",
-                    'size': file_size,
-                    'modified': modified
-                })
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and entry.name.endswith(('.gif', '.png')):
+                    st = entry.stat()
+
+                    gifs.append({
+                        'filename': entry.name,
+                        'path': f"/api/generate/file/{entry.name}",
+                        'size': st.st_size,
+                        'modified': st.st_mtime
+                    })
 
         # Sort by modification time (newest first)
         gifs.sort(key=lambda g: g['modified'], reverse=True)
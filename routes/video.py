@@ -1,5 +1,5 @@
 import math
-import uuid
+import secrets
 import logging
 from pathlib import Path
 from flask import Blueprint, request, jsonify, session, current_app
@@ -56,7 +56,7 @@ def upload_video():
 
         # Save with UUID filename
         ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
+        filename = f"{secrets.token_hex(16)}.{ext}"
 
         uploads_dir = current_app.session_manager.safe_path(session['id'], 'uploads')
         uploads_dir.mkdir(parents=True, exist_ok=True)
@@ -1,17 +1,169 @@
+import os
+import hashlib
 import logging
-from PIL import Image
-from pathlib import Path
+import threading
+import numpy as np
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+from models.project import Project
+from services.image_processor import image_from_array
 
 logger = logging.getLogger(__name__)
 
+# libimagequant gives faster, better palettes than median-cut, but is an
+# optional Pillow build dependency
+PALETTE_METHOD = (Image.Quantize.LIBIMAGEQUANT if features.check_feature('libimagequant')
+                  else Image.Quantize.MEDIANCUT)
+
+# Maps alpha to 0 for fully transparent pixels and 255 for everything else
+OPAQUE_MASK_LUT = [0] + [255] * 255
+
+# Bits kept per channel when binning colors for palette selection
+HISTOGRAM_BITS = 6
+
+
+def _add_to_histogram(histogram, img, weight=1):
+    """
+    Add an image's pixels to a color histogram
+
+    Args:
+        histogram: (4, bins) float array of pixel counts and R, G, B sums
+        img: Image to add (converted to RGB)
+        weight: Number of pixels each pixel of img stands for
+    """
+    rgb = np.asarray(img.convert('RGB')).reshape(-1, 3)
+    shift = 8 - HISTOGRAM_BITS
+    bins = rgb >> shift
+    index = ((bins[:, 0].astype(np.uint32) << (2 * HISTOGRAM_BITS))
+             | (bins[:, 1].astype(np.uint32) << HISTOGRAM_BITS)
+             | bins[:, 2])
+    size = histogram.shape[1]
+    histogram[0] += np.bincount(index, minlength=size) * weight
+    for channel in range(3):
+        histogram[channel + 1] += np.bincount(index, weights=rgb[:, channel], minlength=size) * weight
+
 
 class GifBuilder:
     """Handles GIF creation from project specifications"""
 
+    PREPARE_WORKERS = 8  # max threads for loading/resizing frames
+    FRAME_CACHE_SIZE = 100  # max prepared frames kept between builds
+    FRAME_CACHE_BYTES = 256 * 1024 * 1024  # memory budget for cached frames
+    PROJECT_CACHE_SIZE = 32  # parsed and validated projects kept between builds
+    PALETTE_SAMPLE_SCALE = 4  # frames are shrunk by this factor for palette selection
+    PALETTE_SAMPLE_MIN_PIXELS = 1024 * 1024  # smaller mosaics are used at full size
+
     def __init__(self, config, image_processor):
         self.config = config
         self.image_processor = image_processor
 
+        # Prepared frames from recent builds: key -> (image, bytes)
+        self._frame_cache = OrderedDict()
+        self._frame_cache_bytes = 0
+        self._frame_cache_lock = threading.Lock()
+
+        # Recently parsed projects: (session_id, payload digest) -> (project, is_valid, errors)
+        self._project_cache = OrderedDict()
+        self._project_cache_lock = threading.Lock()
+
+    def load_project(self, session_id, project_data):
+        """
+        Build and validate a Project from request data
+
+        Results are cached per session by a digest of the payload, so repeated
+        previews (and a full render after a preview) of an unchanged project
+        skip parsing and validation. Pass validated=True to build_gif for a
+        project found valid here.
+
+        Returns:
+            (project: Project, is_valid: bool, errors: list)
+        """
+        digest = hashlib.blake2b(orjson.dumps(project_data), digest_size=8).digest()
+        key = (session_id, digest)
+
+        with self._project_cache_lock:
+            cached = self._project_cache.get(key)
+            if cached is not None:
+                self._project_cache.move_to_end(key)
+                return cached
+
+        project = Project.from_dict(project_data)
+        is_valid, errors = project.validate(self.config)
+        result = (project, is_valid, errors)
+
+        with self._project_cache_lock:
+            self._project_cache[key] = result
+            if len(self._project_cache) > self.PROJECT_CACHE_SIZE:
+                self._project_cache.popitem(last=False)
+
+        return result
+
+    def get_prepared_frame(self, frame_path, target_width, target_height, **kwargs):
+        """
+        Prepare a frame via ImageProcessor.prepare_frame, reusing the result
+        of an earlier build (e.g. preview then full render) when the source
+        file and settings are unchanged
+
+        Returns prepared image or None on error. Cached images are shared,
+        so callers must not modify them in place. Raises FileNotFoundError
+        if the source file is missing.
+        """
+        st = os.stat(frame_path)
+        key = (str(frame_path), st.st_mtime_ns, st.st_size, target_width, target_height,
+               tuple(sorted(kwargs.items())))
+
+        with self._frame_cache_lock:
+            cached = self._frame_cache.get(key)
+            if cached is not None:
+                self._frame_cache.move_to_end(key)
+                return cached[0]
+
+        img = self.image_processor.prepare_frame(frame_path, target_width, target_height, **kwargs)
+        if img is None:
+            return None
+
+        size = img.width * img.height * len(img.getbands())
+        with self._frame_cache_lock:
+            if key not in self._frame_cache:
+                self._frame_cache[key] = (img, size)
+                self._frame_cache_bytes += size
+
+                # Evict least recently used frames
+                while (len(self._frame_cache) > self.FRAME_CACHE_SIZE
+                       or self._frame_cache_bytes > self.FRAME_CACHE_BYTES):
+                    _, (_, old_size) = self._frame_cache.popitem(last=False)
+                    self._frame_cache_bytes -= old_size
+
+        return img
+
+    def blend_frames(self, img1, img2, alphas):
+        """
+        Blend two RGBA images at several ratios using NumPy
+
+        Both images are converted to arrays once and each ratio is a single
+        fixed-point multiply-add over the whole image.
+
+        Args:
+            img1: First RGBA image
+            img2: Second RGBA image (same size)
+            alphas: Blend ratios towards img2 (0.0 - 1.0)
+
+        Returns:
+            List of blended RGBA images
+        """
+        a1 = np.asarray(img1, dtype=np.uint16)
+        a2 = np.asarray(img2, dtype=np.uint16)
+
+        blended_frames = []
+        for alpha in alphas:
+            weight = round(alpha * 256)
+            blended = ((256 - weight) * a1 + weight * a2) >> 8
+            blended_frames.append(image_from_array(blended.astype(np.uint8), 'RGBA'))
+
+        return blended_frames
+
     def create_crossfade_frames(self, img1, img2, steps):
         """
         Create transition frames between two images using linear cross-fade
@@ -24,24 +176,17 @@ class GifBuilder:
         Returns:
             List of transition frame images
         """
-        transition_frames = []
-
         # Ensure both images are in RGBA mode for blending
         if img1.mode != 'RGBA':
             img1 = img1.convert('RGBA')
         if img2.mode != 'RGBA':
             img2 = img2.convert('RGBA')
 
-        for i in range(1, steps + 1):
-            # Calculate blend ratio: step i goes from mostly img1 to mostly img2
-            # For step i of N steps: alpha2 = i/(N+1), alpha1 = 1 - alpha2
-            alpha = i / (steps + 1)
-
-            # Blend the two images
-            blended = Image.blend(img1, img2, alpha)
-            transition_frames.append(blended)
+        # Calculate blend ratios: step i goes from mostly img1 to mostly img2
+        # For step i of N steps: alpha2 = i/(N+1), alpha1 = 1 - alpha2
+        alphas = [i / (steps + 1) for i in range(1, steps + 1)]
 
-        return transition_frames
+        return self.blend_frames(img1, img2, alphas)
 
     def create_fade_to_color_frames(self, img1, img2, steps, color):
         """
@@ -56,8 +201,6 @@ class GifBuilder:
         Returns:
             List of transition frame images
         """
-        transition_frames = []
-
         # Ensure both images are in RGBA mode
         if img1.mode != 'RGBA':
             img1 = img1.convert('RGBA')
@@ -69,17 +212,13 @@ class GifBuilder:
 
         # First half: fade from img1 to color
         half_steps = steps // 2
-        for i in range(1, half_steps + 1):
-            alpha = i / (half_steps + 1)
-            blended = Image.blend(img1, color_img, alpha)
-            transition_frames.append(blended)
+        alphas = [i / (half_steps + 1) for i in range(1, half_steps + 1)]
+        transition_frames = self.blend_frames(img1, color_img, alphas)
 
         # Second half: fade from color to img2
         remaining_steps = steps - half_steps
-        for i in range(1, remaining_steps + 1):
-            alpha = i / (remaining_steps + 1)
-            blended = Image.blend(color_img, img2, alpha)
-            transition_frames.append(blended)
+        alphas = [i / (remaining_steps + 1) for i in range(1, remaining_steps + 1)]
+        transition_frames += self.blend_frames(color_img, img2, alphas)
 
         return transition_frames
 
@@ -170,7 +309,91 @@ class GifBuilder:
             logger.warning(f"Unknown transition type '{transition_type}', defaulting to crossfade")
             return self.create_crossfade_frames(img1, img2, steps)
 
-    def build_gif(self, project, output_path, session_manager, session_id, output_format='gif'):
+    def build_master_palette(self, frames, colors, transition_steps=0, transition_type=None):
+        """
+        Compute one adaptive palette shared by all frames
+
+        All frames are quantized together once, so palette selection runs
+        once per GIF instead of once per frame. Transition frames are
+        quantized against the same palette, so they are sampled too;
+        otherwise colors only they contain (e.g. the peak of a fade to
+        white) would be missing.
+
+        Small animations are stacked into one full-size mosaic; larger ones
+        are first reduced by _histogram_sample().
+
+        Args:
+            frames: Prepared frame images (all the same size)
+            colors: Number of palette entries
+            transition_steps: Transition frames between each pair (0 for none)
+            transition_type: Transition type, as for create_transition_frames
+
+        Returns:
+            P-mode image carrying the palette
+        """
+        width, height = frames[0].size
+        total_frames = len(frames) * (1 + transition_steps)
+        if width * height * total_frames > self.PALETTE_SAMPLE_MIN_PIXELS:
+            sample = self._histogram_sample(frames, transition_steps, transition_type)
+        else:
+            sample_frames = []
+            for frame, transitions in zip(frames, self._palette_transitions(
+                    frames, transition_steps, transition_type)):
+                sample_frames.append(frame)
+                sample_frames.extend(transitions)
+
+            sample = Image.new('RGB', (width, height * len(sample_frames)))
+            for i, frame in enumerate(sample_frames):
+                sample.paste(frame.convert('RGB'), (0, i * height))
+
+        return sample.quantize(colors=colors, method=PALETTE_METHOD)
+
+    def _palette_transitions(self, frames, transition_steps, transition_type):
+        """Transition frames following each frame, as one list per frame"""
+        if transition_steps <= 0:
+            return [[] for _ in frames]
+        return [self.create_transition_frames(frame, frames[(i + 1) % len(frames)],
+                                              transition_steps, transition_type)
+                for i, frame in enumerate(frames)]
+
+    def _histogram_sample(self, frames, transition_steps, transition_type):
+        """
+        Reduce frames to a small image with the same color distribution
+
+        Source frames are binned at full resolution, so a small region of a
+        distinct color is counted rather than blurred away as it would be by
+        downscaling. Transition frames only blend source colors, so they are
+        rendered from 1/PALETTE_SAMPLE_SCALE size point-sampled copies, which
+        keep real pixel colors instead of averaging them. Each bin becomes
+        its mean color, repeated once per PALETTE_SAMPLE_SCALE**2 pixels but
+        at least once, which keeps rare colors visible to the quantizer.
+
+        Returns:
+            RGB image of the sampled pixels
+        """
+        scale = self.PALETTE_SAMPLE_SCALE
+        histogram = np.zeros((4, 1 << (3 * HISTOGRAM_BITS)))
+        for frame in frames:
+            _add_to_histogram(histogram, frame)
+
+        if transition_steps > 0:
+            width, height = frames[0].size
+            size = (max(1, width // scale), max(1, height // scale))
+            weight = (width * height) / (size[0] * size[1])
+            samples = [frame.resize(size, Image.Resampling.NEAREST) for frame in frames]
+            for transitions in self._palette_transitions(samples, transition_steps, transition_type):
+                for frame in transitions:
+                    _add_to_histogram(histogram, frame, weight)
+
+        counts = histogram[0]
+        present = np.flatnonzero(counts)
+        colors = np.rint(histogram[1:, present] / counts[present]).astype(np.uint8).T
+        repeats = np.ceil(counts[present] / (scale * scale)).astype(np.intp)
+        pixels = np.repeat(colors, repeats, axis=0)
+        return image_from_array(pixels.reshape(1, -1, 3), 'RGB')
+
+    def build_gif(self, project, output_path, session_manager, session_id, output_format='gif',
+                  preview=False, validated=False):
         """
         Build a GIF from a project
 
@@ -179,6 +402,8 @@ class GifBuilder:
             output_path: Path to save the GIF
             session_manager: SessionManager instance
             session_id: Session ID for path validation
+            preview: If True, resize with the cheaper bilinear filter
+            validated: If True, the project already passed validation
 
         Returns:
             (success: bool, message: str, file_size: int)
@@ -188,16 +413,17 @@ class GifBuilder:
                 return False, "Project has no frames", 0
 
             # Validate project
-            is_valid, errors = project.validate(self.config)
-            if not is_valid:
-                return False, f"Project validation failed: {', '.join(errors)}", 0
+            if not validated:
+                is_valid, errors = project.validate(self.config)
+                if not is_valid:
+                    return False, f"Project validation failed: {', '.join(errors)}", 0
 
             # Get target dimensions and settings
             target_width = project.settings['width']
             target_height = project.settings['height']
             loop_count = project.settings['loop']
             transparent = project.settings.get('transparent', False)
-            background_color = project.settings.get('backgroundColor', '#FFFFFF')
+            background_rgb = self.image_processor.hex_to_rgb(project.settings.get('backgroundColor', '#FFFFFF'))
             alpha_threshold = project.settings.get('alphaThreshold', 128)
             transition_type = project.settings.get('transitionType', 'crossfade')
             transition_time = project.settings.get('transitionTime', 0)
@@ -227,57 +453,81 @@ class GifBuilder:
 
             is_apng = output_format == 'apng'
 
-            # Load and prepare all frames
-            prepared_frames = []
-            durations = []
+            # Previews are transient, so trade resize quality for speed
+            resample = Image.Resampling.BILINEAR if preview else Image.Resampling.LANCZOS
 
-            for frame in project.frames:
+            # Load and prepare a single frame (None if it can't be used)
+            def prepare(frame):
                 # Construct safe file path
                 try:
                     frame_path = session_manager.safe_path(session_id, frame.file)
 
-                    if not frame_path.exists():
-                        logger.error(f"Frame file not found: {frame.file}")
-                        continue
-
                     # Prepare the frame with transparency settings
                     # APNG supports full alpha, so skip binarization
-                    img = self.image_processor.prepare_frame(
+                    img = self.get_prepared_frame(
                         frame_path,
                         target_width,
                         target_height,
                         transparent=transparent,
-                        background_color=background_color,
+                        background_rgb=background_rgb,
                         alpha_threshold=alpha_threshold,
-                        binarize_alpha=not is_apng
+                        binarize_alpha=not is_apng,
+                        resample=resample
                     )
 
                     if img is None:
                         logger.error(f"Failed to prepare frame: {frame.file}")
-                        continue
 
-                    prepared_frames.append(img)
-                    durations.append(frame.duration)
+                    return img
 
+                except FileNotFoundError:
+                    logger.error(f"Frame file not found: {frame.file}")
+                    return None
                 except Exception as e:
                     logger.error(f"Error processing frame {frame.file}: {e}")
-                    continue
+                    return None
+
+            # Load and prepare all frames in parallel; Pillow releases the GIL
+            # while decoding and resizing, so frames overlap across cores
+            with ThreadPoolExecutor(max_workers=min(self.PREPARE_WORKERS, len(project.frames))) as executor:
+                results = list(executor.map(prepare, project.frames))
+
+            prepared_frames = []
+            durations = []
+
+            for frame, img in zip(project.frames, results):
+                if img is not None:
+                    prepared_frames.append(img)
+                    durations.append(frame.duration)
 
             if len(prepared_frames) == 0:
                 return False, "No valid frames to create GIF", 0
 
+            if not is_apng:
+                # One palette for the whole GIF; index 0 is reserved for transparency
+                master_palette = self.build_master_palette(
+                    prepared_frames,
+                    255 if transparent else 256,
+                    transition_steps if transition_time > 0 else 0,
+                    transition_type
+                )
+                transparent_palette = [0, 0, 0] + master_palette.getpalette()
+
             # Helper function to convert image to GIF palette format
             def to_gif_format(img):
+                rgb = img.convert('RGB') if img.mode != 'RGB' else img
+                gif_frame = rgb.quantize(palette=master_palette, dither=Image.Dither.FLOYDSTEINBERG)
+
                 if transparent and img.mode == 'RGBA':
-                    # Convert RGBA to P mode with transparency
-                    gif_frame = img.convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
-                    mask = Image.eval(img.split()[3], lambda a: 255 if a == 0 else 0)
-                    gif_frame.paste(0, mask=mask)
-                    return gif_frame
-                else:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    return img.convert('P', palette=Image.Palette.ADAPTIVE, colors=256)
+                    # Shift colors to indices 1-255 and mark transparent pixels with
+                    # index 0: AND with an alpha mask of 0/255 does both in one pass
+                    indices = np.add(np.asarray(gif_frame), 1, dtype=np.uint8)
+                    opaque = img.getchannel('A').point(OPAQUE_MASK_LUT)
+                    np.bitwise_and(indices, np.asarray(opaque), out=indices)
+                    gif_frame = image_from_array(indices, 'P')
+                    gif_frame.putpalette(transparent_palette)
+
+                return gif_frame
 
             # Helper to ensure RGBA for APNG
             def to_apng_format(img):
@@ -287,46 +537,46 @@ class GifBuilder:
 
             convert_frame = to_apng_format if is_apng else to_gif_format
 
-            # Convert frames and add transitions
-            output_frames = []
+            # Durations of every output frame, including transitions
             output_durations = []
-
-            for i in range(len(prepared_frames)):
-                current_frame = prepared_frames[i]
-                current_duration = durations[i]
-                next_frame = prepared_frames[(i + 1) % len(prepared_frames)]
-
+            for duration in durations:
                 if transition_time > 0:
-                    # Add main frame with reduced duration
-                    main_duration = current_duration - transition_time
-                    output_frames.append(convert_frame(current_frame))
-                    output_durations.append(main_duration)
-
-                    # Create and add transition frames
-                    transition_frames = self.create_transition_frames(
-                        current_frame,
-                        next_frame,
-                        transition_steps,
-                        transition_type
-                    )
-
-                    # Duration per transition frame
+                    # Main frame with reduced duration, then the transition frames
+                    output_durations.append(duration - transition_time)
                     transition_frame_duration = transition_time // transition_steps
                     remainder = transition_time % transition_steps
-
-                    for j, trans_frame in enumerate(transition_frames):
-                        output_frames.append(convert_frame(trans_frame))
-                        # Add remainder to last transition frame to maintain exact timing
-                        dur = transition_frame_duration + (remainder if j == len(transition_frames) - 1 else 0)
-                        output_durations.append(dur)
+                    output_durations.extend([transition_frame_duration] * transition_steps)
+                    # Add remainder to last transition frame to maintain exact timing
+                    output_durations[-1] += remainder
                 else:
-                    # No transitions - just add the frame as-is
-                    output_frames.append(convert_frame(current_frame))
-                    output_durations.append(current_duration)
-
-            # Save animation
-            first_frame = output_frames[0]
-            remaining_frames = output_frames[1:] if len(output_frames) > 1 else []
+                    output_durations.append(duration)
+
+            # Convert frames and add transitions lazily, so only the frame
+            # being written is held in output form
+            def generate_output_frames():
+                for i, current_frame in enumerate(prepared_frames):
+                    yield convert_frame(current_frame)
+
+                    if transition_time > 0:
+                        next_frame = prepared_frames[(i + 1) % len(prepared_frames)]
+                        transition_frames = self.create_transition_frames(
+                            current_frame,
+                            next_frame,
+                            transition_steps,
+                            transition_type
+                        )
+                        for trans_frame in transition_frames:
+                            yield convert_frame(trans_frame)
+
+            # Save animation; the first frame is converted up front and the
+            # rest are pulled from the generator as Pillow writes them
+            output_frames = generate_output_frames()
+            first_frame = next(output_frames)
+            remaining_frames = output_frames
+            if is_apng:
+                # Pillow's APNG writer scans append_images once for modes and
+                # sizes before writing, so it needs a real sequence
+                remaining_frames = list(remaining_frames)
 
             if is_apng:
                 # Save as APNG
@@ -344,7 +594,7 @@ class GifBuilder:
                     'append_images': remaining_frames,
                     'duration': output_durations,
                     'loop': loop_count,
-                    'optimize': False,  # Disable for transparency support
+                    'optimize': not transparent,  # Optimizing would disturb the reserved transparency index
                     'disposal': 2  # Clear to background color
                 }
                 if transparent:
@@ -353,11 +603,11 @@ class GifBuilder:
             first_frame.save(output_path, **save_params)
 
             # Get file size
-            file_size = Path(output_path).stat().st_size
+            file_size = os.stat(output_path).st_size
 
             # Check if output size is within limits
             if file_size > self.config.QUOTAS['max_output_size']:
-                Path(output_path).unlink()  # Delete the file
+                os.unlink(output_path)  # Delete the file
                 fmt_label = 'APNG' if is_apng else 'GIF'
                 return False, f"Generated {fmt_label} exceeds size limit ({file_size} bytes)", 0
 
@@ -369,7 +619,8 @@ class GifBuilder:
             logger.error(f"GIF creation failed: {e}")
             return False, f"GIF creation failed: {str(e)}", 0
 
-    def create_preview_gif(self, project, output_path, session_manager, session_id, max_frames=10, output_format='gif'):
+    def create_preview_gif(self, project, output_path, session_manager, session_id, max_frames=10, output_format='gif',
+                           validated=False):
         """
         Create a preview GIF with limited frames for faster generation
 
@@ -379,6 +630,7 @@ class GifBuilder:
             session_manager: SessionManager instance
             session_id: Session ID
             max_frames: Maximum number of frames to include in preview
+            validated: If True, the project already passed validation
 
         Returns:
             (success: bool, message: str)
@@ -413,7 +665,9 @@ class GifBuilder:
                 output_path,
                 session_manager,
                 session_id,
-                output_format=output_format
+                output_format=output_format,
+                preview=True,
+                validated=validated
             )
 
             if success and len(project.frames) > max_frames:
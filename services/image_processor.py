@@ -1,22 +1,61 @@
+import re
 import logging
+import threading
+import numpy as np
+from collections import OrderedDict
 from PIL import Image, ImageOps
-from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Trailing file extension, e.g. "photo.JPG" -> "JPG"
+_EXT_RE = re.compile(r'\.([A-Za-z0-9]{1,5})$')
+
+
+def image_from_array(arr, mode):
+    """
+    Wrap a uint8 NumPy array as a PIL image without copying the pixels
+
+    The image shares the array's memory and stays writable, so the caller
+    must not reuse the array afterwards.
+    """
+    arr = np.ascontiguousarray(arr)
+    height, width = arr.shape[:2]
+    img = Image.frombuffer(mode, (width, height), arr, 'raw', mode, 0, 1)
+    img.readonly = 0
+    return img
+
 
 class ImageProcessor:
     """Handles image loading, validation, and transformations"""
 
+    META_CACHE_SIZE = 10000  # uploaded images whose header info is kept in memory
+    BACKGROUND_CACHE_SIZE = 16  # solid background templates kept in memory
+
     def __init__(self, config):
         self.config = config
-        self.allowed_extensions = config.ALLOWED_EXTENSIONS
+        self.allowed_extensions = frozenset(config.ALLOWED_EXTENSIONS)
         self.allowed_mimetypes = config.ALLOWED_MIMETYPES
 
+        # Header info cache: (session_id, filename) -> (mtime, size, width, height)
+        self._meta_cache = OrderedDict()
+        self._meta_lock = threading.Lock()
+
+        # Solid background templates: {(mode, size, color): Image}
+        self._backgrounds = {}
+        self._background_lock = threading.Lock()
+
+    def get_file_extension(self, filename):
+        """Return the lowercased file extension if it is allowed, otherwise None"""
+        match = _EXT_RE.search(filename)
+        if match:
+            ext = match.group(1).lower()
+            if ext in self.allowed_extensions:
+                return ext
+        return None
+
     def validate_file_extension(self, filename):
         """Check if file has an allowed extension"""
-        ext = Path(filename).suffix.lower().lstrip('.')
-        return ext in self.allowed_extensions
+        return self.get_file_extension(filename) is not None
 
     def load_and_validate_image(self, file_path):
         """
@@ -24,46 +63,77 @@ class ImageProcessor:
         Returns (Image, error_message)
         """
         try:
-            # Open image
-            img = Image.open(file_path)
-
-            # Verify it's actually an image
-            img.verify()
-
-            # Reopen after verify (verify() closes the file)
+            # Open image; format and size come from the header without
+            # decoding any pixels
             img = Image.open(file_path)
-
-            # Save format before orientation correction
             img_format = img.format
 
-            # Apply EXIF orientation if present
-            img = ImageOps.exif_transpose(img)
-
-            # Restore format if it was lost
-            if img and not hasattr(img, 'format'):
-                img.format = img_format
-
             # Check format
             if img_format and img_format.lower() not in ['png', 'jpeg', 'gif', 'webp']:
-                return None, f"Unsupported image format: {img.format}"
+                return None, f"Unsupported image format: {img_format}"
 
             # Check dimensions
             width, height = img.size
             if not self.check_dimensions(width, height):
                 return None, f"Image dimensions {width}x{height} exceed maximum {self.config.QUOTAS['max_dimension']}"
 
+            # Apply EXIF orientation if present. This decodes the image, so a
+            # corrupt or truncated file raises here.
+            img = ImageOps.exif_transpose(img)
+            img.format = img_format
+
             return img, None
 
         except Exception as e:
             logger.error(f"Image validation failed: {e}")
             return None, f"Invalid image file: {str(e)}"
 
+    def get_image_info(self, session_id, entry):
+        """
+        Get (size, width, height) for an uploaded image
+
+        Args:
+            session_id: Session the image belongs to
+            entry: os.DirEntry for the image file
+
+        The image header is only parsed again when the file's mtime changes.
+        """
+        st = entry.stat()
+
+        key = (session_id, entry.name)
+        with self._meta_lock:
+            cached = self._meta_cache.get(key)
+            if cached is not None:
+                self._meta_cache.move_to_end(key)
+        if cached and cached[0] == st.st_mtime:
+            return cached[1], cached[2], cached[3]
+
+        with Image.open(entry.path) as img:
+            width, height = img.size
+
+        with self._meta_lock:
+            self._meta_cache[key] = (st.st_mtime, st.st_size, width, height)
+            self._meta_cache.move_to_end(key)
+
+            # Evict least recently used entries
+            while len(self._meta_cache) > self.META_CACHE_SIZE:
+                self._meta_cache.popitem(last=False)
+
+        return st.st_size, width, height
+
+    def evict_session_cache(self, session_id):
+        """Drop cached image info for a session"""
+        with self._meta_lock:
+            for key in [key for key in self._meta_cache if key[0] == session_id]:
+                del self._meta_cache[key]
+
     def check_dimensions(self, width, height):
         """Check if dimensions are within limits"""
         max_dim = self.config.QUOTAS['max_dimension']
         return width <= max_dim and height <= max_dim
 
-    def resize_image(self, img, target_width, target_height, fit_mode='contain'):
+    def resize_image(self, img, target_width, target_height, fit_mode='contain', background=None,
+                     resample=Image.Resampling.LANCZOS):
         """
         Resize image to target dimensions
 
@@ -72,18 +142,25 @@ class ImageProcessor:
         - 'cover': Fill dimensions, maintain aspect ratio, crop if needed
         - 'fill': Exact dimensions, maintain aspect ratio, pad if needed
         - 'stretch': Exact dimensions, ignore aspect ratio
+
+        background: Padding color in the image's mode; None pads with
+        transparent RGBA
+        resample: Pillow resampling filter
         """
         try:
             if fit_mode == 'stretch':
                 # Simply resize to exact dimensions
-                return img.resize((target_width, target_height), Image.Resampling.LANCZOS)
+                return img.resize((target_width, target_height), resample)
 
             elif fit_mode == 'contain':
                 # Fit inside while maintaining aspect ratio
-                img.thumbnail((target_width, target_height), Image.Resampling.LANCZOS)
+                img.thumbnail((target_width, target_height), resample)
 
                 # Create new image with padding if needed
-                new_img = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
+                if background is None:
+                    new_img = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
+                else:
+                    new_img = self.get_background(img.mode, (target_width, target_height), background)
 
                 # Calculate position to center the image
                 x = (target_width - img.width) // 2
@@ -107,7 +184,7 @@ class ImageProcessor:
                     new_height = int(target_width / img_aspect)
 
                 # Resize
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                img = img.resize((new_width, new_height), resample)
 
                 # Crop to target dimensions
                 left = (new_width - target_width) // 2
@@ -119,7 +196,7 @@ class ImageProcessor:
 
             else:  # 'fill' is default
                 # Same as contain for now
-                return self.resize_image(img, target_width, target_height, 'contain')
+                return self.resize_image(img, target_width, target_height, 'contain', background, resample)
 
         except Exception as e:
             logger.error(f"Image resize failed: {e}")
@@ -130,9 +207,30 @@ class ImageProcessor:
         hex_color = hex_color.lstrip('#')
         return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
+    def get_background(self, mode, size, color, copy=True):
+        """
+        Return a fresh solid-color image, copied from a cached template
+
+        All frames of a project share the same size and background, so only
+        the first one pays for creating the template. With copy=False the
+        shared template itself is returned and must not be modified.
+        """
+        key = (mode, size, color)
+        with self._background_lock:
+            template = self._backgrounds.get(key)
+
+        if template is None:
+            template = Image.new(mode, size, color)
+            with self._background_lock:
+                if len(self._backgrounds) >= self.BACKGROUND_CACHE_SIZE:
+                    self._backgrounds.clear()
+                template = self._backgrounds.setdefault(key, template)
+
+        return template.copy() if copy else template
+
     def prepare_frame(self, file_path, target_width, target_height,
-                      transparent=False, background_color='#FFFFFF', alpha_threshold=128,
-                      binarize_alpha=True):
+                      transparent=False, background_rgb=(255, 255, 255), alpha_threshold=128,
+                      binarize_alpha=True, resample=Image.Resampling.LANCZOS):
         """
         Load and prepare a frame for GIF creation
 
@@ -141,8 +239,9 @@ class ImageProcessor:
             target_width: Target width
             target_height: Target height
             transparent: If True, preserve transparency in GIF
-            background_color: Hex color for background when not transparent
+            background_rgb: RGB tuple for background when not transparent
             alpha_threshold: Threshold (0-255) for converting semi-transparent to opaque/transparent
+            resample: Pillow resampling filter used for resizing
 
         Returns prepared image or None on error
         """
@@ -151,12 +250,23 @@ class ImageProcessor:
             logger.error(f"Failed to prepare frame: {error}")
             return None
 
+        # Opaque source without transparency: stay in RGB and pad with the
+        # background color directly, skipping the RGBA resize and flatten
+        # (a tRNS color key counts, whatever the mode)
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        if not transparent and not has_alpha:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            return self.resize_image(img, target_width, target_height, 'contain',
+                                     background=background_rgb,
+                                     resample=resample)
+
         # Convert to RGBA for consistent processing
         if img.mode != 'RGBA':
             img = img.convert('RGBA')
 
         # Resize to target dimensions (keeping RGBA)
-        img = self.resize_image(img, target_width, target_height, 'contain')
+        img = self.resize_image(img, target_width, target_height, 'contain', resample=resample)
 
         if img is None:
             return None
@@ -169,23 +279,14 @@ class ImageProcessor:
             if binarize_alpha:
                 # Convert semi-transparent pixels based on threshold
                 # GIF only supports 1-bit transparency (fully transparent or fully opaque)
-                pixels = img.load()
-                width, height = img.size
-
-                for y in range(height):
-                    for x in range(width):
-                        r, g, b, a = pixels[x, y]
-                        if a < alpha_threshold:
-                            # Make fully transparent
-                            pixels[x, y] = (0, 0, 0, 0)
-                        else:
-                            # Make fully opaque
-                            pixels[x, y] = (r, g, b, 255)
+                arr = np.array(img)
+                transparent_mask = arr[:, :, 3] < alpha_threshold
+                arr[transparent_mask] = 0  # Make fully transparent
+                arr[~transparent_mask, 3] = 255  # Make fully opaque
+                img = image_from_array(arr, 'RGBA')
 
             return img
         else:
-            # Flatten to background color
-            bg_rgb = self.hex_to_rgb(background_color)
-            background = Image.new('RGB', img.size, bg_rgb)
-            background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-            return background
+            # Flatten to background color in one compositing pass
+            background = self.get_background('RGBA', img.size, background_rgb + (255,), copy=False)
+            return Image.alpha_composite(background, img).convert('RGB')
@@ -10,10 +10,17 @@ class QuotaManager:
         self.session_manager = session_manager
         self.quotas = config.QUOTAS
 
-    def check_storage_quota(self, session_id):
-        """Check if session has exceeded total storage quota"""
+    def check_storage_quota(self, session_id, stats=None):
+        """
+        Check if session has exceeded total storage quota
+
+        Args:
+            session_id: Session to check
+            stats: Session stats already fetched by the caller (optional)
+        """
         try:
-            stats = self.session_manager.get_session_stats(session_id)
+            if stats is None:
+                stats = self.session_manager.get_session_stats(session_id)
             if stats is None:
                 return True  # New session, no storage used yet - allow
 
@@ -27,10 +34,17 @@ class QuotaManager:
             logger.error(f"Error checking storage quota: {e}")
             return True  # On error, allow rather than block
 
-    def check_image_count_quota(self, session_id):
-        """Check if session has exceeded max image count"""
+    def check_image_count_quota(self, session_id, stats=None):
+        """
+        Check if session has exceeded max image count
+
+        Args:
+            session_id: Session to check
+            stats: Session stats already fetched by the caller (optional)
+        """
         try:
-            stats = self.session_manager.get_session_stats(session_id)
+            if stats is None:
+                stats = self.session_manager.get_session_stats(session_id)
             if stats is None:
                 return True  # New session, no images yet - allow upload
 
@@ -120,26 +134,37 @@ class QuotaManager:
             logger.error(f"Error getting remaining quota: {e}")
             return None
 
-    def can_upload(self, session_id, file_size):
+    def can_upload(self, session_id, file_size, stats=None):
         """
         Check if a file can be uploaded based on all relevant quotas
+
+        Args:
+            session_id: Session to check
+            file_size: Size of the file in bytes (0 to check only whether
+                the session has room for another upload)
+            stats: Session stats from before the upload, already fetched by
+                the caller (optional)
         """
         # Check file size
         if not self.check_file_size(file_size):
             return False, "File size exceeds maximum allowed"
 
+        # Walk the session once and share the stats between the checks
+        if stats is None:
+            stats = self.session_manager.get_session_stats(session_id)
+        if stats is None:
+            return True, "OK"  # New session, nothing stored yet
+
         # Check image count
-        if not self.check_image_count_quota(session_id):
+        if not self.check_image_count_quota(session_id, stats):
             return False, "Maximum number of images reached"
 
         # Check total storage
-        if not self.check_storage_quota(session_id):
+        if not self.check_storage_quota(session_id, stats):
             return False, "Storage quota exceeded"
 
         # Check if adding this file would exceed storage quota
-        stats = self.session_manager.get_session_stats(session_id)
-        if stats:
-            if stats['total_size'] + file_size > self.quotas['max_total_storage']:
-                return False, "Adding this file would exceed storage quota"
+        if stats['total_size'] + file_size > self.quotas['max_total_storage']:
+            return False, "Adding this file would exceed storage quota"
 
         return True, "OK"
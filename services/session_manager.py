@@ -1,47 +1,206 @@
 import os
+import re
 import time
+import stat
 import shutil
-import secrets
+import sqlite3
+import hashlib
 import logging
+import threading
+import orjson
+from base64 import urlsafe_b64encode
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Top-level shard directory names under user_data_dir
+_SHARD_RE = re.compile(r'[0-9a-f]{2}')
+
+# Set access times without following symlinks where the platform supports
+# it (os.utime raises NotImplementedError otherwise)
+_UTIME_NOFOLLOW = {'follow_symlinks': False} if os.utime in os.supports_follow_symlinks else {}
+
+
+def _scandir_walk(top):
+    """
+    Walk a directory tree top-down, like os.walk but yielding DirEntry lists
+
+    Yields (dirpath, dir_entries, file_entries) for each directory. Entries
+    carry the type (and on most platforms the stat) from the listing, so
+    callers need not stat paths again. Symlinks are not followed and appear
+    in neither list.
+    """
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        dirs = []
+        files = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry)
+        yield dirpath, dirs, files
+        stack.extend(entry.path for entry in dirs)
+
+
+def _fast_rmtree(path):
+    """
+    Delete a directory tree bottom-up with one scandir per directory
+
+    Skips shutil.rmtree's per-entry stat and error-handler machinery.
+    Symlinks are unlinked, never followed, including at the root. Raises
+    OSError on failure.
+    """
+    if not stat.S_ISDIR(os.lstat(path).st_mode):
+        os.unlink(path)
+        return
+
+    dirs = []
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+
+    # Parents were listed before their children
+    for directory in reversed(dirs):
+        os.rmdir(directory)
+
+
+# Session subdirectories whose entries are counted: name -> (stats key, suffix)
+_COUNTED_DIRS = {
+    'uploads': ('image_count', ''),
+    'projects': ('project_count', '.json'),
+    'output': ('output_count', '.gif'),
+}
+
+
+def _scan_session(session_dir, stats):
+    """
+    Fill in size and file counts for a session directory in one pass
+
+    Every directory is listed once and every regular file stat()ed once;
+    the counted subdirectories are tallied from the same listing.
+    """
+    counted_dirs = {os.path.join(session_dir, name): counted
+                    for name, counted in _COUNTED_DIRS.items()}
+
+    for dirpath, _, files in _scandir_walk(session_dir):
+        for entry in files:
+            stats['total_size'] += entry.stat(follow_symlinks=False).st_size
+
+        counted = counted_dirs.get(dirpath)
+        if counted is not None:
+            key, suffix = counted
+            stats[key] += sum(1 for entry in files
+                              if not entry.name.startswith('.') and entry.name.endswith(suffix))
+
 
 class SessionManager:
+    META_FILE = 'meta.json'  # session metadata; its mtime is the last access time
+    CLEANUP_MIN_INTERVAL = 60  # seconds between cleanup runs, however often scheduled
+    SESSION_DIR_CACHE_SIZE = 10000  # entries per session_id -> directory cache (plain and resolved)
+    INDEX_FILE = 'index.db'  # SQLite index of session access times, in user_data_dir
+    INDEX_VERSION = 2  # bump to re-seed existing indexes from a full scan
+
     def __init__(self, config):
         self.config = config
-        self.user_data_dir = Path(config.USER_DATA_DIR)
+        self.user_data_dir = os.fspath(config.USER_DATA_DIR)
         self.session_lifetime = config.CLEANUP_CONFIG['session_lifetime'] * 3600  # Convert to seconds
         self.orphan_file_age = config.CLEANUP_CONFIG['orphan_file_age'] * 3600
 
+        # Last-access times buffered in memory, written by flush_access_times()
+        self.pending_access = {}
+        self._access_lock = threading.Lock()
+
+        # Session directory paths: {session_id: str}
+        self._session_dirs = {}
+
+        # Resolved session directories used by safe_path: {session_id: str}
+        self._resolved_base = {}
+
+        # Cleanup worker state; see start_cleanup_worker()
+        self._cleanup_event = threading.Event()
+        self._last_cleanup = time.monotonic()
+
         # Ensure base directory exists
-        self.user_data_dir.mkdir(parents=True, exist_ok=True)
+        os.makedirs(self.user_data_dir, exist_ok=True)
+        self.user_data_realpath = os.path.realpath(self.user_data_dir)
+
+        # Durable last-access index shared by all worker processes
+        self._index_lock = threading.Lock()
+        self._index = self._open_index()
+
+    def _open_index(self):
+        """
+        Open (creating if needed) the SQLite index of session access times
+
+        Cleanup range-scans it for expired sessions instead of listing every
+        session directory. WAL mode lets worker processes share it.
+        """
+        db = sqlite3.connect(os.path.join(self.user_data_dir, self.INDEX_FILE),
+                             timeout=10, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                       'sid TEXT PRIMARY KEY, accessed_at REAL NOT NULL) WITHOUT ROWID')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_sessions_accessed ON sessions (accessed_at)')
+        return db
 
     def create_session_id(self):
-        """Generate a secure session ID"""
-        return secrets.token_urlsafe(32)
+        """Generate a secure session ID (256 random bits, URL-safe base64)"""
+        return urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode('ascii')
 
     def get_session_dir(self, session_id):
-        """Get the directory path for a session"""
-        return self.user_data_dir / session_id
+        """
+        Get the directory path for a session.
+        Sessions are sharded as {ab}/{cd}/{session_id} so no single
+        directory grows with the total number of sessions. Paths are
+        memoized, since every request looks up its session directory.
+        """
+        session_dir = self._session_dirs.get(session_id)
+        if session_dir is None:
+            shard = hashlib.blake2b(session_id.encode(), digest_size=2).hexdigest()
+            session_dir = os.path.join(self.user_data_dir, shard[:2], shard[2:], session_id)
+            if len(self._session_dirs) >= self.SESSION_DIR_CACHE_SIZE:
+                self._session_dirs.clear()
+            self._session_dirs[session_id] = session_dir
+        return session_dir
 
     def initialize_session_storage(self, session_id):
         """Create directory structure for a new session"""
         session_dir = self.get_session_dir(session_id)
 
         try:
-            # Create subdirectories
-            (session_dir / 'uploads').mkdir(parents=True, exist_ok=True)
-            (session_dir / 'projects').mkdir(parents=True, exist_ok=True)
-            (session_dir / 'output').mkdir(parents=True, exist_ok=True)
-
-            # Create metadata file
+            # Create the session directory (and its shard parents), then the
+            # subdirectories directly beneath it
+            os.makedirs(session_dir, exist_ok=True)
+            for sub in ('uploads', 'projects', 'output'):
+                try:
+                    os.mkdir(os.path.join(session_dir, sub))
+                except FileExistsError:
+                    pass
+
+            # Create metadata file atomically; its mtime tracks last access
             metadata = {
                 'created': time.time(),
-                'last_accessed': time.time(),
             }
+            meta_path = os.path.join(session_dir, self.META_FILE)
+            tmp_path = os.path.join(session_dir, f".{self.META_FILE}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(metadata))
+            os.replace(tmp_path, meta_path)
+            self._track_access([(session_id, metadata['created'])])
 
             logger.info(f"Initialized session storage for: {session_id}")
             return True
@@ -51,25 +210,86 @@ class SessionManager:
             return False
 
     def update_session_access(self, session_id):
-        """Update the last accessed time for a session"""
+        """Record the last accessed time for a session (no disk I/O)"""
+        with self._access_lock:
+            self.pending_access[session_id] = time.time()
+
+    def flush_access_times(self):
+        """Write buffered last-access times to the session directories"""
+        with self._access_lock:
+            pending = self.pending_access
+            self.pending_access = {}
+
+        if not pending:
+            return
+
+        # Writes are independent; overlap their latency instead of issuing them serially
+        with ThreadPoolExecutor(max_workers=min(8, len(pending))) as pool:
+            pool.map(self._write_access_time, pending.keys(), pending.values())
+
+        self._track_access(pending.items())
+
+    def _track_access(self, accesses):
+        """Record (session_id, accessed) pairs in the cleanup index"""
+        try:
+            with self._index_lock, self._index:
+                self._index.executemany(
+                    'INSERT INTO sessions (sid, accessed_at) VALUES (?, ?) '
+                    'ON CONFLICT (sid) DO UPDATE SET accessed_at = max(accessed_at, excluded.accessed_at)',
+                    accesses)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update session index: {e}")
+
+    def _forget_access(self, session_ids):
+        """Remove sessions from the cleanup index"""
+        try:
+            with self._index_lock, self._index:
+                self._index.executemany('DELETE FROM sessions WHERE sid = ?',
+                                        [(session_id,) for session_id in session_ids])
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update session index: {e}")
+
+    def _write_access_time(self, session_id, accessed):
+        """Set the session's metadata mtime, which cleanup uses as last access"""
         session_dir = self.get_session_dir(session_id)
-        if session_dir.exists():
-            # Touch the directory to update modification time
-            session_dir.touch(exist_ok=True)
+        try:
+            try:
+                os.utime(os.path.join(session_dir, self.META_FILE), (accessed, accessed),
+                         **_UTIME_NOFOLLOW)
+            except FileNotFoundError:
+                # Sessions created before metadata files were written
+                os.utime(session_dir, (accessed, accessed), **_UTIME_NOFOLLOW)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to update access time for {session_id}: {e}")
+
+    def _last_access_time(self, session_dir):
+        """
+        Last access time of a session directory
+
+        Reads the metadata file's mtime; the directory's own mtime also
+        changes whenever files are added or removed, so it is only a
+        fallback for sessions without metadata. Raises FileNotFoundError
+        if the session directory does not exist.
+        """
+        try:
+            return os.stat(os.path.join(session_dir, self.META_FILE)).st_mtime
+        except FileNotFoundError:
+            return os.stat(session_dir).st_mtime
 
     def validate_session(self, session_id):
         """Check if a session is valid and not expired"""
         if not session_id:
             return False
 
-        session_dir = self.get_session_dir(session_id)
-
-        if not session_dir.exists():
+        # Check if session exists and has not expired (one stat)
+        try:
+            last_access = self._last_access_time(self.get_session_dir(session_id))
+        except (FileNotFoundError, PermissionError):
             return False
 
-        # Check if session has expired
-        created_time = session_dir.stat().st_mtime
-        if time.time() - created_time > self.session_lifetime:
+        if time.time() - last_access > self.session_lifetime:
             logger.info(f"Session expired: {session_id}")
             return False
 
@@ -80,37 +300,142 @@ class SessionManager:
         Generate a safe path within a session directory.
         Prevents directory traversal attacks.
         """
-        base = self.get_session_dir(session_id).resolve()
-        target = (base / Path(*path_parts)).resolve()
-
-        # Ensure target is within base directory
-        if not str(target).startswith(str(base)):
+        base = self._resolved_base.get(session_id)
+        if base is None:
+            base = os.path.realpath(self.get_session_dir(session_id))
+            if len(self._resolved_base) >= self.SESSION_DIR_CACHE_SIZE:
+                self._resolved_base.clear()
+            self._resolved_base[session_id] = base
+
+        target = os.path.realpath(os.path.join(base, *map(os.fspath, path_parts)))
+
+        # Ensure target is within base directory (a plain prefix check would
+        # also accept sibling directories that share the prefix)
+        if os.path.commonpath([target, base]) != base:
             raise ValueError("Invalid path: directory traversal detected")
 
-        return target
+        return Path(target)
+
+    def _migrate_legacy_sessions(self):
+        """
+        Move flat user_data/{session_id} directories from before sharding
+        into their shard, so cleanup can find and expire them
+
+        Their directory mtime is the last access time, and rename keeps it.
+        """
+        with os.scandir(self.user_data_dir) as it:
+            legacy = [entry for entry in it
+                      if entry.is_dir(follow_symlinks=False) and not _SHARD_RE.fullmatch(entry.name)]
+
+        for entry in legacy:
+            target = self.get_session_dir(entry.name)
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(entry.path, target)
+                logger.info(f"Moved legacy session directory {entry.name} into its shard")
+            except OSError as e:
+                logger.warning(f"Failed to move legacy session directory {entry.name}: {e}")
+
+    def _iter_session_dirs(self):
+        """Yield an os.DirEntry for every session directory under the shards"""
+        def subdirs(path):
+            with os.scandir(path) as it:
+                return [entry for entry in it if entry.is_dir(follow_symlinks=False)]
+
+        for shard1 in subdirs(self.user_data_dir):
+            for shard2 in subdirs(shard1.path):
+                yield from subdirs(shard2.path)
+
+    def _find_expired_sessions(self, cutoff_time):
+        """
+        List (session_id, path) for sessions last accessed before cutoff_time
+
+        Candidates come from an indexed range scan of the access index and
+        are re-checked on disk, since meta.json is the source of truth. The
+        first run against a new index moves legacy flat session directories
+        into their shards and scans every session directory once to seed it
+        with sessions that predate the index.
+        """
+        expired = []
+        live = []
+        gone = []
+        last_access_time = self._last_access_time
+
+        with self._index_lock:
+            seeded = self._index.execute('PRAGMA user_version').fetchone()[0] >= self.INDEX_VERSION
+
+        if not seeded:
+            self._migrate_legacy_sessions()
+            for entry in self._iter_session_dirs():
+                try:
+                    accessed = last_access_time(entry.path)
+                except FileNotFoundError:
+                    continue
+                if accessed < cutoff_time:
+                    expired.append((entry.name, entry.path))
+                live.append((entry.name, accessed))
+            self._track_access(live)
+            with self._index_lock:
+                self._index.execute(f'PRAGMA user_version = {self.INDEX_VERSION}')
+            return expired
+
+        with self._index_lock:
+            candidates = self._index.execute(
+                'SELECT sid FROM sessions WHERE accessed_at < ?', (cutoff_time,)).fetchall()
+
+        for (session_id,) in candidates:
+            path = self.get_session_dir(session_id)
+            try:
+                accessed = last_access_time(path)
+            except FileNotFoundError:
+                gone.append(session_id)
+                continue
+            if accessed < cutoff_time:
+                expired.append((session_id, path))
+            else:
+                live.append((session_id, accessed))
+
+        self._track_access(live)
+        self._forget_access(gone)
+        return expired
 
     def cleanup_old_sessions(self):
-        """Remove sessions older than the configured lifetime"""
-        if not self.user_data_dir.exists():
-            return
+        """
+        Remove sessions older than the configured lifetime
+
+        Returns list of removed session IDs
+        """
+        removed = []
+        if not os.path.isdir(self.user_data_dir):
+            return removed
 
         cutoff_time = time.time() - self.session_lifetime
         cleaned_count = 0
 
         try:
-            for session_dir in self.user_data_dir.iterdir():
-                if not session_dir.is_dir():
-                    continue
+            # Find sessions old enough to clean up
+            expired = self._find_expired_sessions(cutoff_time)
+
+            if expired:
+                # Sessions are independent, so overlap their deletes
+                with ThreadPoolExecutor(max_workers=min(16, len(expired))) as pool:
+                    futures = [pool.submit(self._remove_session_dir, path) for _, path in expired]
 
-                # Check if session is old enough to clean up
-                created_time = session_dir.stat().st_mtime
-                if created_time < cutoff_time:
+                forget_base = self._resolved_base.pop
+                forget_dir = self._session_dirs.pop
+                for (session_id, _), future in zip(expired, futures):
                     try:
-                        shutil.rmtree(session_dir)
+                        future.result()
+                        forget_base(session_id, None)
+                        forget_dir(session_id, None)
+                        removed.append(session_id)
                         cleaned_count += 1
-                        logger.info(f"Cleaned up old session: {session_dir.name}")
+                        logger.info(f"Cleaned up old session: {session_id}")
                     except Exception as e:
-                        logger.error(f"Failed to cleanup session {session_dir.name}: {e}")
+                        logger.error(f"Failed to cleanup session {session_id}: {e}")
+
+                # Failed sessions stay indexed, so the next run retries them
+                self._forget_access(removed)
 
             if cleaned_count > 0:
                 logger.info(f"Cleanup completed: removed {cleaned_count} old sessions")
@@ -118,13 +443,68 @@ class SessionManager:
         except Exception as e:
             logger.error(f"Session cleanup failed: {e}")
 
+        return removed
+
+    def _remove_session_dir(self, path):
+        """Delete a session directory tree, which must be inside user_data_dir"""
+        base = self.user_data_dir
+        if path == base or os.path.commonpath([path, base]) != base:
+            raise ValueError(f"Refusing to delete outside user data: {path}")
+
+        try:
+            _fast_rmtree(path)
+        except OSError as e:
+            if not os.path.lexists(path):
+                raise  # Nothing left to retry on
+            # Fall back to the general implementation, e.g. for races with
+            # files created while deleting
+            logger.warning(f"Fast delete of {path} failed ({e}), retrying with shutil.rmtree")
+            shutil.rmtree(path)
+
+    def schedule_cleanup(self):
+        """Ask the cleanup worker to run soon, without waiting for it"""
+        self._cleanup_event.set()
+
+    def start_cleanup_worker(self, interval, on_removed=None):
+        """
+        Start a daemon thread that runs cleanup_old_sessions
+
+        The worker runs every interval seconds, or sooner when
+        schedule_cleanup() is called, but never more than once per
+        CLEANUP_MIN_INTERVAL seconds.
+
+        Args:
+            interval: Seconds between unscheduled runs
+            on_removed: Optional callback given the list of removed session IDs
+        """
+        thread = threading.Thread(target=self._cleanup_worker, args=(interval, on_removed),
+                                  name='session-cleanup', daemon=True)
+        thread.start()
+        return thread
+
+    def _cleanup_worker(self, interval, on_removed):
+        """Cleanup loop run by the thread from start_cleanup_worker()"""
+        while True:
+            self._cleanup_event.wait(timeout=interval)
+            self._cleanup_event.clear()
+
+            # Debounce bursts of schedule_cleanup() calls
+            delay = self._last_cleanup + self.CLEANUP_MIN_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_cleanup = time.monotonic()
+
+            try:
+                removed = self.cleanup_old_sessions()
+                if on_removed is not None:
+                    on_removed(removed)
+            except Exception as e:
+                logger.error(f"Cleanup worker run failed: {e}")
+
     def get_session_stats(self, session_id):
         """Get statistics about a session's storage usage"""
         session_dir = self.get_session_dir(session_id)
 
-        if not session_dir.exists():
-            return None
-
         stats = {
             'total_size': 0,
             'image_count': 0,
@@ -133,24 +513,11 @@ class SessionManager:
         }
 
         try:
-            # Calculate total size
-            for file_path in session_dir.rglob('*'):
-                if file_path.is_file():
-                    stats['total_size'] += file_path.stat().st_size
-
-            # Count files in each directory
-            uploads_dir = session_dir / 'uploads'
-            if uploads_dir.exists():
-                stats['image_count'] = len(list(uploads_dir.glob('*')))
-
-            projects_dir = session_dir / 'projects'
-            if projects_dir.exists():
-                stats['project_count'] = len(list(projects_dir.glob('*.json')))
-
-            output_dir = session_dir / 'output'
-            if output_dir.exists():
-                stats['output_count'] = len(list(output_dir.glob('*.gif')))
+            # Total size and per-directory counts in a single walk
+            _scan_session(session_dir, stats)
 
+        except FileNotFoundError:
+            return None
         except Exception as e:
             logger.error(f"Failed to get session stats: {e}")
 
@@ -160,13 +527,16 @@ class SessionManager:
         """Manually delete a session and all its data"""
         session_dir = self.get_session_dir(session_id)
 
-        if session_dir.exists():
-            try:
-                shutil.rmtree(session_dir)
-                logger.info(f"Deleted session: {session_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Failed to delete session {session_id}: {e}")
-                return False
+        try:
+            self._remove_session_dir(session_dir)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Failed to delete session {session_id}: {e}")
+            return False
 
-        return False
+        self._resolved_base.pop(session_id, None)
+        self._session_dirs.pop(session_id, None)
+        self._forget_access([session_id])
+        logger.info(f"Deleted session: {session_id}")
+        return True
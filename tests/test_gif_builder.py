@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from config import config
+from services.gif_builder import GifBuilder
+from services.image_processor import ImageProcessor
+
+
+def quantize(img, palette):
+    """Quantize an RGBA frame against a master palette, as build_gif does"""
+    return img.convert('RGB').quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+
+
+class MasterPaletteTest(unittest.TestCase):
+    def setUp(self):
+        self.builder = GifBuilder(config, ImageProcessor(config))
+        rng = np.random.default_rng(0)
+        self.frames = [
+            Image.fromarray(np.dstack([
+                rng.integers(10, 60, (80, 100, 3)).astype(np.uint8),
+                np.full((80, 100), 255, np.uint8),
+            ]), 'RGBA')
+            for _ in range(2)
+        ]
+
+    def assert_transition_colors(self, transition_type, color):
+        palette = self.builder.build_master_palette(self.frames, 256, 5, transition_type)
+        transitions = self.builder.create_transition_frames(
+            self.frames[0], self.frames[1], 5, transition_type)
+
+        # The middle frame of a fade is closest to the fade color
+        peak = transitions[2]
+        quantized = np.asarray(quantize(peak, palette).convert('RGB'), dtype=float)
+        expected = np.asarray(peak.convert('RGB'), dtype=float)
+
+        self.assertLess(np.abs(quantized - expected).mean(), 3)
+        self.assertLess(np.abs(quantized.mean(axis=(0, 1)) - color).max(), 60)
+
+    def test_fade_to_white_keeps_white(self):
+        self.assert_transition_colors('fade-to-white', (255, 255, 255))
+
+    def test_fade_to_black_keeps_black(self):
+        self.assert_transition_colors('fade-to-black', (0, 0, 0))
+
+
+class PaletteSampleTest(unittest.TestCase):
+    def setUp(self):
+        self.sampled = GifBuilder(config, ImageProcessor(config))
+        self.full = GifBuilder(config, ImageProcessor(config))
+        self.full.PALETTE_SAMPLE_MIN_PIXELS = float('inf')
+
+        # 64 flat color blocks plus a 4x4 red square, large enough that the
+        # sampled builder does not use the full-size mosaic
+        yy, xx = np.mgrid[0:768, 0:1024]
+        pixels = np.stack([(xx // 128) * 32, (yy // 96) * 32, np.full_like(xx, 90)], axis=-1)
+        pixels[100:104, 100:104] = (250, 20, 20)
+        self.frames = [Image.fromarray(pixels.astype(np.uint8), 'RGB')] * 2
+
+    def red_error(self, builder, **kwargs):
+        palette = builder.build_master_palette(self.frames, 256, **kwargs)
+        entries = np.array(palette.getpalette()[:768]).reshape(-1, 3)
+        return np.abs(entries - (250, 20, 20)).sum(axis=1).min()
+
+    def frame_error(self, builder):
+        palette = builder.build_master_palette(self.frames, 256)
+        quantized = quantize(self.frames[0], palette).convert('RGB')
+        return np.abs(np.asarray(quantized, dtype=float) - np.asarray(self.frames[0], dtype=float)).mean()
+
+    def test_sampled_palette_keeps_small_color_region(self):
+        full_error = self.red_error(self.full)
+        self.assertLessEqual(full_error, 6)
+        self.assertLessEqual(self.red_error(self.sampled), full_error + 6)
+
+    def test_sampled_palette_matches_full_quality(self):
+        self.assertLessEqual(self.frame_error(self.sampled), self.frame_error(self.full) + 0.5)
+
+    def test_sampled_palette_with_transitions(self):
+        full_error = self.red_error(self.full, transition_steps=2, transition_type='crossfade')
+        sampled_error = self.red_error(self.sampled, transition_steps=2, transition_type='crossfade')
+        self.assertLessEqual(sampled_error, full_error + 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
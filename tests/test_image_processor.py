@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from config import config
+from services.image_processor import ImageProcessor
+
+
+class PrepareFrameTest(unittest.TestCase):
+    KEY = (10, 200, 10)
+
+    def setUp(self):
+        self.processor = ImageProcessor(config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+        # RGB PNG whose left half is the tRNS color key
+        pixels = np.full((20, 20, 3), (200, 50, 50), np.uint8)
+        pixels[:, :10] = self.KEY
+        self.path = os.path.join(self.tmpdir.name, 'keyed.png')
+        Image.fromarray(pixels, 'RGB').save(self.path, transparency=self.KEY)
+
+    def test_color_key_is_flattened_to_background(self):
+        img = self.processor.prepare_frame(self.path, 20, 20, background_rgb=(255, 255, 255))
+        arr = np.asarray(img.convert('RGB'))
+        self.assertTrue((arr[:, :10] == 255).all())
+        self.assertTrue((arr[:, 10:] == (200, 50, 50)).all())
+
+    def test_color_key_is_transparent(self):
+        img = self.processor.prepare_frame(self.path, 20, 20, transparent=True)
+        alpha = np.asarray(img.getchannel('A'))
+        self.assertTrue((alpha[:, :10] == 0).all())
+        self.assertTrue((alpha[:, 10:] == 255).all())
+
+
+if __name__ == '__main__':
+    unittest.main()